@@ -1,216 +1,198 @@
 import streamlit as st
-import xml.etree.ElementTree as ET
-import html
-import re
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import io
 import zipfile
-import graphviz  # Requires Graphviz system install
-from typing import List, Dict, Tuple, Optional
+import xlsxwriter
+from typing import List, Dict, Tuple, Optional, Iterator, Iterable
 import os
 import tempfile
 import gc
-
-
-# Helper: split raw XML into individual <IVRScripts> blocks
-def parse_ivrscripts_blocks(xml_text: str) -> List[str]:
-    xml_text = xml_text.lstrip('\ufeff')  # strip BOM
-    xml_text = re.sub(r'^\s*<\?xml[^>]+\?>', '', xml_text)
-    wrapped = f"<root>{xml_text}</root>"
-    root = ET.fromstring(wrapped)
-    blocks = [ET.tostring(node, encoding='unicode') for node in root.findall('.//IVRScripts')]
-    return blocks
-
-# Helper: clean embedded IVR XMLDefinition for valid parsing
-def clean_xml_definition(raw_def: str) -> str:
-    xml = html.unescape(raw_def)
-    xml = re.sub(r'&(?!amp;|lt;|gt;|quot;|apos;)', '&amp;', xml)
-    xml = xml.replace("\x00", "")
-    xml = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F]', '', xml)
-    return xml
-
-# Extract Call vs Simple Variables
-def extract_variables(ivr_root: ET.Element, script_name: str) -> Tuple[List[Dict], List[Dict]]:
-    call_vars, vars_ = [], []
-    modules_elem = ivr_root.find('modules')
-    if modules_elem is None:
-        return call_vars, vars_
-    for mod in modules_elem:
-        tag = mod.tag
-        name = mod.findtext('moduleName', default='').strip()
-        for ve in mod.findall('.//variableName'):
-            text = ve.text.strip() if ve.text else ''
-            if not text:
-                continue
-            row = {'Script Name': script_name, 'Variable Name': text,
-                   'Module Name': name, 'Source Module': tag}
-            if '.' in text:
-                group, _ = text.split('.', 1)
-                row.update({'Type': 'Call Variable', 'Group': group})
-                call_vars.append(row)
-            else:
-                row.update({'Type': 'Variable', 'Group': ''})
-                vars_.append(row)
-    return call_vars, vars_
-
-# Extract Skills
-def extract_skills(ivr_root: ET.Element, script_name: str) -> List[Dict]:
-    skills = []
-    modules_elem = ivr_root.find('modules')
-    if modules_elem is None:
-        return skills
-    for mod in modules_elem:
-        if mod.tag == 'skillTransfer':
-            name = mod.findtext('moduleName', default='').strip()
-            for skl in mod.findall('.//listOfSkillsEx/extrnalObj/name'):
-                text = skl.text.strip() if skl.text else ''
-                if text:
-                    skills.append({'Script Name': script_name,
-                                   'Skill Name': text,
-                                   'Module Name': name})
-    return skills
-
-# Extract Prompts
-def extract_prompts(ivr_root: ET.Element, script_name: str) -> List[Dict]:
-    prompts = []
-    modules_elem = ivr_root.find('modules')
-    if modules_elem is None:
-        return prompts
-    for mod in modules_elem:
-        name = mod.findtext('moduleName', default='').strip()
-        for prm in mod.findall('.//prompt'):
-            tag = prm.find('name')
-            text = tag.text.strip() if tag is not None and tag.text else ''
-            if text:
-                prompts.append({'Script Name': script_name,
-                                'Prompt Name': text,
-                                'Module Name': name})
-    return prompts
+import itertools
+import multiprocessing
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait
+
+from ivr_parser import iter_ivrscripts, process_script
+
+# Uploads with more scripts than this are parsed across a process pool. This server process is
+# multi-threaded, so workers are never forked from it: they start from a forkserver (or spawn)
+# and import the Streamlit-free ivr_parser module rather than this script
+_PARALLEL_MIN_SCRIPTS = 64
+_POOL_CTX = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if _POOL_CTX.get_start_method() == 'forkserver':
+    _POOL_CTX.set_forkserver_preload(['ivr_parser'])  # lxml is loaded once, in the server
+
+_SVG_CACHE_SIZE = 512  # rendered diagrams kept process-wide
+_PRERENDER_BATCH = 8  # diagrams per background `dot` run; bounds how long a view waits on one
+_ZIP_SPOOL_MAX = 64 << 20  # diagram ZIPs larger than this are built on disk
+
+# Output columns per section; extracted rows are tuples in this order
+_COLUMNS = {
+    'Call Variables': ['Script Name', 'Variable Name', 'Module Name', 'Source Module', 'Type', 'Group'],
+    'Variables': ['Script Name', 'Variable Name', 'Module Name', 'Source Module', 'Type', 'Group'],
+    'Skills': ['Script Name', 'Skill Name', 'Module Name'],
+    'Prompts': ['Script Name', 'Prompt Name', 'Module Name'],
+}
+
+# Row cap for the per-script debug tables
+_DEBUG_MAX_ROWS = 1000
+
+# Low-cardinality columns stored as pandas categoricals (int codes, one shared string pool)
+_CATEGORY_COLUMNS = frozenset({'Script Name', 'Module Name', 'Source Module', 'Type', 'Group'})
+# Remaining (high-cardinality) text columns: Arrow-backed strings on pandas 2 as well as 3, so
+# nunique/str.contains run as pyarrow.compute kernels instead of over Python objects
+_TEXT_DTYPE = pd.StringDtype('pyarrow')
 
 # Build DataFrame
-def make_df(rows: List[Dict], sort_cols: List[str] = None) -> pd.DataFrame:
+def make_df(rows: set, columns: List[str], sort_cols: List[str] = None) -> pd.DataFrame:
     if not rows:
         return pd.DataFrame()
-    df = pd.DataFrame(rows).drop_duplicates()
+    df = pd.DataFrame.from_records(list(rows), columns=columns)
+    for col in columns:
+        if col in _CATEGORY_COLUMNS:
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = df[col].astype(_TEXT_DTYPE)
     if sort_cols:
-        df = df.sort_values(by=sort_cols)
+        df = df.sort_values(by=sort_cols, ignore_index=True)
     return df
 
-# Build Graph Data
-def build_flow_graph(ivr_root: ET.Element) -> Tuple[Dict[str, List[Tuple[str, Optional[str]]]], Dict[str, str]]:
-    edges, labels = {}, {}
-    modules_elem = ivr_root.find('modules')
-    if modules_elem is None:
-        return edges, labels
-    for mod in modules_elem:
-        mid = mod.findtext('moduleId', default='').strip()
-        lbl = mod.findtext('moduleName', default='').strip() or mod.tag
-        if mid:
-            edges[mid] = []
-            labels[mid] = lbl
-    for mod in modules_elem:
-        src = mod.findtext('moduleId', default='').strip()
-        if src not in edges:
-            continue
-        for sd in mod.findall('singleDescendant'):
-            child = sd.text.strip()
-            if child in labels:
-                edges[src].append((child, None))
-        for entry in mod.findall('.//branches/entry'):
-            k = entry.find('key')
-            d = entry.find('.//value/desc')
-            if k is not None and d is not None:
-                child = d.text.strip()
-                key = k.text.strip()
-                if child in labels:
-                    edges[src].append((child, key))
-    return edges, labels
-
-# Process a single script block
-@st.cache_data
-def process_script(blk: str, idx: int) -> Tuple[str, Dict, bool]:
-    try:
-        outer = ET.fromstring(blk)
-    except Exception as e:
-        return f'Script {idx}', {'error': str(e)}, False
-    
-    name = outer.findtext('Name', default='').strip() or f'Script {idx}'
-    xml_def = outer.findtext('XMLDefinition', default='')
-    
-    if not xml_def:
-        return name, {'error': 'Missing XMLDefinition'}, False
-    
-    cleaned = clean_xml_definition(xml_def)
-    try:
-        ivr = ET.fromstring(cleaned)
-    except ET.ParseError as e:
-        return name, {'error': f'Inner XML parse: {e}'}, False
-    
-    cvs, vs = extract_variables(ivr, name)
-    ss = extract_skills(ivr, name)
-    ps = extract_prompts(ivr, name)
-    
-    data = {
-        'Call Variables': cvs,
-        'Variables': vs,
-        'Skills': ss,
-        'Prompts': ps,
-        'XMLDefinition': cleaned  # Store for diagram rendering
-    }
-    
-    return name, data, True
+# Helper: yield per-script results as they complete, across a process pool for large uploads.
+# Only the first few scripts are peeked at to pick a path; the serial path keeps streaming
+def _iter_results(scripts: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, Dict, bool]]:
+    it = iter(scripts)
+    head = list(itertools.islice(it, _PARALLEL_MIN_SCRIPTS + 1))
+    if (os.cpu_count() or 1) > 1 and len(head) > _PARALLEL_MIN_SCRIPTS:
+        head.extend(it)
+        names, xml_defs = zip(*head)
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=_POOL_CTX) as ex:
+            yield from ex.map(process_script, names, xml_defs, range(1, len(head) + 1), chunksize=8)
+    else:
+        for idx, (name, xml_def) in enumerate(itertools.chain(head, it), start=1):
+            yield process_script(name, xml_def, idx)
 
 # Main function to batch process all scripts
-@st.cache_data
-def process_all_scripts(scripts: List[str]) -> Tuple[List[str], List[Dict], List[Dict], List[Dict], List[Dict], List[Dict]]:
-    call_vars, vars_, skills, prompts, failed = [], [], [], [], []
+def process_all_scripts(scripts: Iterable[Tuple[str, str]]) -> Tuple[List[str], Dict, set, set, set, set, List[Dict]]:
+    call_vars, vars_, skills, prompts, failed = set(), set(), set(), set(), []
     script_names = []
     script_data = {}
     
-    for idx, blk in enumerate(scripts, start=1):
-        name, data, success = process_script(blk, idx)
+    for name, data, success in _iter_results(scripts):
         script_names.append(name)
         
         if not success:
             failed.append({'Script Name': name, 'Error': data.get('error', 'Unknown error')})
             continue
         
-        script_data[name] = data
-        call_vars.extend(data['Call Variables'])
-        vars_.extend(data['Variables'])
-        skills.extend(data['Skills'])
-        prompts.extend(data['Prompts'])
+        # Per-script rows live only in the combined sets; the debug view slices the DataFrames
+        script_data[name] = {'Dot': data['Dot']}
+        call_vars.update(data['Call Variables'])
+        vars_.update(data['Variables'])
+        skills.update(data['Skills'])
+        prompts.update(data['Prompts'])
     
     return script_names, script_data, call_vars, vars_, skills, prompts, failed
 
-# Generate a single diagram SVG
-@st.cache_data
-def generate_diagram(xml_def: str) -> graphviz.Digraph:
-    try:
-        ivr_tree = ET.fromstring(xml_def)
-        edges, labels = build_flow_graph(ivr_tree)
-        
-        dot = graphviz.Digraph(
-            format='svg',
-            graph_attr={'rankdir':'LR'},
-            node_attr={'shape':'box','style':'rounded,filled','fillcolor':'#eef4fd'},
-            edge_attr={'arrowsize':'0.7'}
-        )
-        
-        for nid, lbl in labels.items():
-            dot.node(nid, lbl)
-            
-        for src, succs in edges.items():
-            for dst, key in succs:
-                if key:
-                    dot.edge(src, dst, xlabel=key)
-                else:
-                    dot.edge(src, dst)
-                    
-        return dot
-    except Exception as e:
-        st.error(f"Diagram generation error: {e}")
-        return None
+# Build the four section DataFrames from the merged row sets
+def get_dataframes(call_vars: set, vars_: set, skills: set, prompts: set) -> Tuple[pd.DataFrame, ...]:
+    df_call = make_df(call_vars, _COLUMNS['Call Variables'], sort_cols=['Script Name', 'Variable Name'])
+    df_vars = make_df(vars_, _COLUMNS['Variables'], sort_cols=['Script Name', 'Variable Name'])
+    df_skill = make_df(skills, _COLUMNS['Skills'], sort_cols=['Script Name', 'Skill Name'])
+    df_prompt = make_df(prompts, _COLUMNS['Prompts'], sort_cols=['Script Name', 'Prompt Name'])
+    return df_call, df_vars, df_skill, df_prompt
+
+# Parse an uploaded file once per distinct content straight into the section tables. The tables
+# are kept in session_state, so the raw row sets never become a cache key that every rerun re-hashes
+@st.cache_data(show_spinner=False)
+def process_upload(raw: bytes) -> Tuple[List[str], Dict, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, List[Dict]]:
+    script_names, script_data, call_vars, vars_, skills, prompts, failed = \
+        process_all_scripts(iter_ivrscripts(io.BytesIO(raw)))
+    return (script_names, script_data, *get_dataframes(call_vars, vars_, skills, prompts), failed)
+
+# Helper: process-wide SVG memo keyed by DOT source, shared by the diagram download, the ZIP
+# export and upload-time pre-rendering. cache_resource keeps the one dict alive across reruns
+# (which re-execute this script); background threads are handed the dict rather than calling this
+@st.cache_resource
+def _svg_cache() -> Dict[str, bytes]:
+    return {}
+
+# Helper: store a rendered SVG, evicting the oldest entries past the cap
+def _remember_svg(cache: Dict[str, bytes], source: str, svg: bytes) -> None:
+    cache[source] = svg
+    while len(cache) > _SVG_CACHE_SIZE:
+        try:
+            del cache[next(iter(cache))]
+        except (KeyError, RuntimeError):  # another thread touched the memo mid-eviction
+            break
+
+# Helper: render one DOT source to SVG, raising with dot's own error text
+def _render_dot(source: str) -> bytes:
+    res = subprocess.run(['dot', '-Tsvg'], input=source.encode('utf-8'), capture_output=True)
+    if res.returncode:
+        raise RuntimeError(res.stderr.decode('utf-8', 'replace').strip() or f'dot exited with status {res.returncode}')
+    return res.stdout
+
+# Helper: memoised single render
+def _svg_for(source: str) -> bytes:
+    cache = _svg_cache()
+    svg = cache.get(source)
+    if svg is None:
+        svg = _render_dot(source)
+        _remember_svg(cache, source, svg)
+    return svg
+
+# Render several DOT sources in one `dot` run (-O writes <input>.svg beside each file), saving a
+# process launch per diagram; runs in ZIP worker threads, so no Streamlit calls here.
+# Graphs dot could not render come back as None; if the run itself failed, every file it left may
+# be partial, so the whole batch comes back as None and goes through the per-graph _render_dot path
+def _render_dot_batch(sources: List[str]) -> List[Optional[bytes]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f'{i}.gv') for i in range(len(sources))]
+        for path, source in zip(paths, sources):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(source)
+        try:
+            res = subprocess.run(['dot', '-Tsvg', '-O', *paths], capture_output=True)
+        except OSError:
+            return [None] * len(sources)
+        if res.returncode:
+            return [None] * len(sources)
+        svgs = []
+        for path in paths:
+            try:
+                with open(path + '.svg', 'rb') as f:
+                    svgs.append(f.read() or None)  # an empty file is a miss, not an SVG
+            except OSError:
+                svgs.append(None)
+        return svgs
+
+# Helper: one background pool per process for upload-time diagram pre-rendering (survives reruns)
+@st.cache_resource
+def _prerender_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='diagram-prerender')
+
+# Render a batch into the memo; runs on the pre-render pool, so no Streamlit calls here
+def _prerender_batch(cache: Dict[str, bytes], sources: List[str]) -> None:
+    for source, svg in zip(sources, _render_dot_batch(sources)):
+        if svg is not None:
+            _remember_svg(cache, source, svg)
+
+# Queue an upload's not-yet-rendered diagrams (up to the memo size) as small `dot` runs in script
+# order, so the first scripts are ready first; returns the future covering each queued source
+def _prerender_diagrams(sources: List[str]) -> Dict[str, Future]:
+    cache = _svg_cache()
+    misses = [source for source in dict.fromkeys(sources[:_SVG_CACHE_SIZE]) if source not in cache]
+    pool = _prerender_pool()
+    futures = {}
+    for start in range(0, len(misses), _PRERENDER_BATCH):
+        batch = misses[start:start + _PRERENDER_BATCH]
+        future = pool.submit(_prerender_batch, cache, batch)
+        futures.update(dict.fromkeys(batch, future))
+    return futures
 
 # Streamlit UI
 st.set_page_config(page_title='Five9 IVR Audit Tool v10.3', page_icon='📞', layout='wide')
@@ -242,29 +224,38 @@ st.markdown('Upload IVR XML to extract data and render call-flow diagrams.')
 # State management
 if 'processed' not in st.session_state:
     st.session_state.processed = False
+    st.session_state.file_id = None
     st.session_state.script_names = []
     st.session_state.script_data = {}
-    st.session_state.call_vars = []
-    st.session_state.vars_ = []
-    st.session_state.skills = []
-    st.session_state.prompts = []
+    st.session_state.df_call = pd.DataFrame()
+    st.session_state.df_vars = pd.DataFrame()
+    st.session_state.df_skill = pd.DataFrame()
+    st.session_state.df_prompt = pd.DataFrame()
     st.session_state.failed = []
+    st.session_state.diagram_futures = {}
 
 # File uploader
 uploaded_file = st.file_uploader('Upload IVR XML file', type='xml')
-
-if uploaded_file is not None and not st.session_state.processed:
+# UploadedFile.file_id arrived in Streamlit 1.27; older releases only have .id
+upload_id = None if uploaded_file is None else (getattr(uploaded_file, 'file_id', None) or uploaded_file.id)
+
+if uploaded_file is not None and upload_id != st.session_state.file_id:
+    raw = uploaded_file.getvalue()
+    # Cheap byte scan catches wrong files (e.g. config exports) before any parsing
+    if b'<IVRScripts' not in raw:
+        st.warning('No <IVRScripts> found — is this the right export?')
+        st.stop()
     with st.spinner('Processing XML file...'):
-        raw = uploaded_file.read().decode('utf-8')
         try:
-            scripts = parse_ivrscripts_blocks(raw)
-            st.session_state.script_names, st.session_state.script_data, st.session_state.call_vars, \
-            st.session_state.vars_, st.session_state.skills, st.session_state.prompts, \
-            st.session_state.failed = process_all_scripts(scripts)
+            st.session_state.script_names, st.session_state.script_data, st.session_state.df_call, \
+            st.session_state.df_vars, st.session_state.df_skill, st.session_state.df_prompt, \
+            st.session_state.failed = process_upload(raw)
             st.session_state.processed = True
-            # Clear memory
-            del raw, scripts
-            gc.collect()
+            st.session_state.file_id = upload_id
+            # Render diagrams in the background while the tables are browsed
+            st.session_state.diagram_futures = _prerender_diagrams(
+                [st.session_state.script_data[name]['Dot'] for name in st.session_state.script_names
+                 if name in st.session_state.script_data])
         except Exception as e:
             st.error(f"Failed to process XML: {e}")
             st.stop()
@@ -278,23 +269,23 @@ search = st.sidebar.text_input('Filter all tables')
 def filter_df(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty or not search:
         return df
-    mask = df.apply(lambda row: row.astype(str).str.contains(search, case=False).any(), axis=1)
+    # One vectorised literal match per column, OR-ed together; categoricals test each distinct value once
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            hits = values.cat.categories.astype(str).str.contains(search, case=False, regex=False)
+            mask |= np.asarray(hits)[values.cat.codes.to_numpy()]
+        else:
+            mask |= values.str.contains(search, case=False, regex=False).to_numpy(dtype=bool, na_value=False)
     return df[mask]
 
-# Build DataFrames on demand
-@st.cache_data
-def get_dataframes(call_vars, vars_, skills, prompts):
-    df_call = make_df(call_vars, sort_cols=['Script Name', 'Variable Name'])
-    df_vars = make_df(vars_, sort_cols=['Script Name', 'Variable Name'])
-    df_skill = make_df(skills, sort_cols=['Script Name', 'Skill Name'])
-    df_prompt = make_df(prompts, sort_cols=['Script Name', 'Prompt Name'])
-    return df_call, df_vars, df_skill, df_prompt
-
-df_call, df_vars, df_skill, df_prompt = get_dataframes(
-    st.session_state.call_vars,
-    st.session_state.vars_,
-    st.session_state.skills,
-    st.session_state.prompts
+# Section tables built at upload time
+df_call, df_vars, df_skill, df_prompt = (
+    st.session_state.df_call,
+    st.session_state.df_vars,
+    st.session_state.df_skill,
+    st.session_state.df_prompt
 )
 
 # Filter DataFrames
@@ -303,26 +294,35 @@ fv = filter_df(df_vars)
 fs = filter_df(df_skill)
 fp = filter_df(df_prompt)
 
+# Excel workbook, rebuilt only when the underlying tables change
+@st.cache_data(show_spinner=False)
+def build_xlsx(df_call: pd.DataFrame, df_vars: pd.DataFrame, df_skill: pd.DataFrame,
+               df_prompt: pd.DataFrame, failed: List[Dict]) -> bytes:
+    e_buf = io.BytesIO()
+    # constant_memory flushes each row to disk as soon as the next starts, so rows are written in
+    # order here; pandas' to_excel fills column by column, which this mode would silently drop
+    workbook = xlsxwriter.Workbook(e_buf, {'constant_memory': True})
+    header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    sheets = [('Call Variables', df_call), ('Variables', df_vars), ('Skills', df_skill), ('Prompts', df_prompt)]
+    if failed:
+        sheets.append(('Failures', pd.DataFrame(failed)))
+    for sheet_name, df in sheets:
+        ws = workbook.add_worksheet(sheet_name)
+        ws.write_row(0, 0, df.columns, header_fmt)
+        for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            ws.write_row(r, 0, row)
+    workbook.close()
+    return e_buf.getvalue()
+
 # Excel export - generate only when requested
 if st.sidebar.button('Generate Excel Report'):
     with st.spinner('Generating Excel report...'):
-        e_buf = io.BytesIO()
-        with pd.ExcelWriter(e_buf, engine='openpyxl') as writer:
-            df_call.to_excel(excel_writer=writer, sheet_name='Call Variables', index=False)
-            df_vars.to_excel(excel_writer=writer, sheet_name='Variables', index=False)
-            df_skill.to_excel(excel_writer=writer, sheet_name='Skills', index=False)
-            df_prompt.to_excel(excel_writer=writer, sheet_name='Prompts', index=False)
-            if st.session_state.failed:
-                pd.DataFrame(st.session_state.failed).to_excel(excel_writer=writer, sheet_name='Failures', index=False)
-        
         st.sidebar.download_button(
             'Download Excel Report',
-            data=e_buf.getvalue(),
+            data=build_xlsx(df_call, df_vars, df_skill, df_prompt, st.session_state.failed),
             file_name='ivr_report_v10.3.xlsx',
             mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         )
-        del e_buf
-        gc.collect()
 
 # Summary Metrics
 st.subheader('🔍 Summary Metrics')
@@ -333,6 +333,14 @@ c2.metric('Failures', len(st.session_state.failed))
 c3.metric('Unique Call Variables', fc['Variable Name'].nunique() if not fc.empty else 0)
 c4.metric('Unique Variables', fv['Variable Name'].nunique() if not fv.empty else 0)
 
+# CSV serialisation is cached so repeat downloads don't re-encode the table;
+# Arrow's multithreaded writer is several times faster than DataFrame.to_csv
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
 # Detail Sections with pagination
 def show_section(title: str, df: pd.DataFrame, filename: str):
     st.markdown(f'**{title}**')
@@ -356,14 +364,14 @@ def show_section(title: str, df: pd.DataFrame, filename: str):
             
         start_idx = st.session_state[page_key] * page_size
         end_idx = min(start_idx + page_size, len(df))
-        st.dataframe(df.iloc[start_idx:end_idx], use_container_width=True)
+        st.dataframe(df.iloc[start_idx:end_idx], use_container_width=True, hide_index=True)
         
         if st.button(f'Download {filename}', key=f"download_{title}"):
-            csv = df.to_csv(index=False)
             st.download_button(
                 f'Download {filename}',
-                csv,
-                filename
+                to_csv_bytes(df),
+                filename,
+                mime='text/csv'
             )
     else:
         st.info(f'No {title.lower()} found.')
@@ -382,10 +390,9 @@ with tab4:
 with tab5:
     if st.session_state.failed:
         df_fail = pd.DataFrame(st.session_state.failed)
-        st.dataframe(df_fail, use_container_width=True)
+        st.dataframe(df_fail, use_container_width=True, hide_index=True)
         if st.button('Download failures.csv'):
-            csv = df_fail.to_csv(index=False)
-            st.download_button('Download failures.csv', csv, 'ivr_failures.csv')
+            st.download_button('Download failures.csv', to_csv_bytes(df_fail), 'ivr_failures.csv', mime='text/csv')
     else:
         st.info('No failures reported.')
 
@@ -394,80 +401,99 @@ st.subheader('🎨 Call Flow Diagram')
 selected = st.selectbox('Select Script', st.session_state.script_names)
 
 if selected:
-    script_data = st.session_state.script_data.get(selected, {})
-    xml_def = script_data.get('XMLDefinition', '')
+    script_data = st.session_state.script_data.get(selected)
     
-    if xml_def:
+    if script_data:
         with st.spinner('Rendering diagram...'):
-            dot = generate_diagram(xml_def)
-            if dot:
-                st.graphviz_chart(dot)
-                
-                # Get SVG string for download
-                svg_str = dot.pipe(format='svg').decode('utf-8')
-                st.download_button(
-                    "Download Diagram (SVG)",
-                    data=svg_str,
-                    file_name=f"{selected}.svg",
-                    mime="image/svg+xml"
-                )
+            # The DOT string itself, which every Streamlit release's graphviz_chart accepts
+            source = script_data['Dot']
+            st.graphviz_chart(source)
+            
+            # A diagram whose background batch is already running is waited for (a few graphs at
+            # most) rather than rendered twice; one still queued, possibly behind other sessions'
+            # batches, is pulled from the queue and rendered here instead
+            future = st.session_state.diagram_futures.get(source)
+            if future is not None and source not in _svg_cache() and not future.cancel():
+                try:
+                    future.result()
+                except Exception:
+                    pass  # a failed batch falls back to rendering here, with dot's error surfaced
+            
+            # SVG bytes go to the download as-is; no decode/re-encode round trip
+            svg_bytes = _svg_for(source)
+            st.download_button(
+                "Download Diagram (SVG)",
+                data=svg_bytes,
+                file_name=f"{selected}.svg",
+                mime="image/svg+xml"
+            )
     else:
         st.error(f"Failed to load diagram data for {selected}")
 
-# Batch export diagrams with chunking
+# Batch export diagrams: memoised SVGs are reused, the rest split into one `dot` run per worker
 if st.button('Generate All Diagrams (SVG) ZIP'):
     with st.spinner('Building ZIP of all SVG diagrams…'):
         progress = st.progress(0)
-        total = len(st.session_state.script_names)
+        names = [name for name in st.session_state.script_names if name in st.session_state.script_data]
+        sources = [st.session_state.script_data[name]['Dot'] for name in names]
+        # Let this upload's background pre-render finish rather than render the same graphs twice
+        wait(set(st.session_state.diagram_futures.values()))
+        svg_cache = _svg_cache()
+        svgs = [svg_cache.get(source) for source in sources]
+        misses = [i for i, svg in enumerate(svgs) if svg is None]
+        
+        if misses:
+            workers = min(os.cpu_count() or 1, len(misses))
+            batches = [misses[w::workers] for w in range(workers)]
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                rendered = ex.map(_render_dot_batch, [[sources[i] for i in batch] for batch in batches])
+                for done, (batch, batch_svgs) in enumerate(zip(batches, rendered), start=1):
+                    for i, svg in zip(batch, batch_svgs):
+                        if svg is not None:
+                            svgs[i] = svg
+                            _remember_svg(svg_cache, sources[i], svg)
+                    progress.progress(done / len(batches))
         
-        # Create ZIP buffer
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zf:
-            # Process diagrams in chunks to reduce memory usage
-            chunk_size = 5
-            for i in range(0, total, chunk_size):
-                chunk = st.session_state.script_names[i:i+chunk_size]
-                
-                for idx, name in enumerate(chunk):
-                    script_data = st.session_state.script_data.get(name, {})
-                    xml_def = script_data.get('XMLDefinition', '')
-                    
-                    if xml_def:
-                        try:
-                            dot = generate_diagram(xml_def)
-                            if dot:
-                                # Get SVG as string and write directly to ZIP
-                                svg_str = dot.pipe(format='svg').decode('utf-8')
-                                zf.writestr(f"{name}.svg", svg_str)
-                        except Exception as e:
-                            st.error(f"Error generating diagram for {name}: {e}")
-                
-                progress.progress(min(1.0, (i + len(chunk)) / total))
-                gc.collect()  # Clear memory after each chunk
+        # SVG is verbose text and deflates well; the spool stays in memory for typical exports
+        # and spills to disk past _ZIP_SPOOL_MAX instead of holding a second large buffer
+        zip_spool = tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_MAX)
+        with zipfile.ZipFile(zip_spool, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            for name, source, svg in zip(names, sources, svgs):
+                if svg is None:
+                    # Render on its own so dot's error for this script can be reported
+                    try:
+                        svg = _svg_for(source)
+                    except Exception as e:
+                        st.error(f"Error generating diagram for {name}: {e}")
+                        continue
+                zf.writestr(f"{name}.svg", svg)
+        progress.progress(1.0)
             
-        zip_buffer.seek(0)
+        zip_spool.seek(0)
         st.download_button(
             'Download All Diagrams (SVG ZIP)',
-            data=zip_buffer.getvalue(),
+            data=zip_spool.read(),
             file_name='all_diagrams_svg.zip',
             mime='application/zip'
         )
         # Clean up
-        del zip_buffer
+        zip_spool.close()
         gc.collect()
 
 # Debug Tools - load on demand
 with st.expander('🐞 Debug Tools'):
     sel2 = st.selectbox('Inspect Script', st.session_state.script_names)
-    script_debug_data = st.session_state.script_data.get(sel2, {})
     
-    if script_debug_data:
-        for section in ['Call Variables', 'Variables', 'Skills', 'Prompts']:
-            rows = script_debug_data.get(section, [])
+    if sel2 in st.session_state.script_data:
+        for section, df in [('Call Variables', df_call), ('Variables', df_vars),
+                            ('Skills', df_skill), ('Prompts', df_prompt)]:
             st.markdown(f'**{section}**')
-            df_dbg = make_df(rows)
+            df_dbg = df[df['Script Name'] == sel2] if not df.empty else df
             if not df_dbg.empty:
-                st.dataframe(df_dbg, use_container_width=True, height=200)
+                # Only a preview goes to the browser; the CSV/Excel downloads carry the full set
+                st.dataframe(df_dbg.head(_DEBUG_MAX_ROWS), use_container_width=True, height=200, hide_index=True)
+                if len(df_dbg) > _DEBUG_MAX_ROWS:
+                    st.caption(f'Showing {_DEBUG_MAX_ROWS} of {len(df_dbg)}; download for full set.')
             else:
                 st.info(f'No {section.lower()} for this script.')
 
@@ -0,0 +1,204 @@
+# XML parsing for the IVR Audit Tool: splits an upload into scripts and extracts each one.
+# Kept free of Streamlit so process-pool workers can import it without the app.
+from lxml import etree as ET
+import html
+import re
+import sys
+import threading
+from typing import List, Dict, Tuple, Optional, Iterator, BinaryIO
+
+# Upload read size for streaming the outer envelope
+_READ_CHUNK = 1 << 20
+
+# Inner-document parsers, one per thread (Streamlit sessions each run in their own thread)
+_PARSER_LOCAL = threading.local()
+
+# XMLDefinition cleanup patterns, compiled once
+_AMP_RE = re.compile(r'&(?!amp;|lt;|gt;|quot;|apos;)')
+_CTRL_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F]')
+_DEL_TBL = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20)])
+
+# Diagram DOT text: quoted-string escapes and the shared graph/node/edge attributes
+_DOT_ESCAPE = str.maketrans({'"': '\\"', '\\': '\\\\', '\n': '\\n', '\r': ''})
+_DOT_HEADER = ('digraph {\n\tgraph [rankdir=LR]\n'
+               '\tnode [fillcolor="#eef4fd" shape=box style="rounded,filled"]\n'
+               '\tedge [arrowsize=0.7]\n')
+
+# Flow-graph branch lookups, compiled once and reused for every module
+_BRANCH_ENTRY_XPATH = ET.XPath('.//branches/entry')
+# string() hands back the first desc's text directly; plain strings don't pin the tree in the cache
+_BRANCH_DESC_XPATH = ET.XPath('string(.//value/desc)', smart_strings=False)
+
+# Elements visited by the per-module walk; skills are only read from skillTransfer modules
+_MODULE_TAGS = ('variableName', 'prompt')
+_SKILL_MODULE_TAGS = ('variableName', 'prompt', 'listOfSkillsEx')
+# Interned, so a module tag that has been through sys.intern can be compared by identity
+_SKILL_TRANSFER = sys.intern('skillTransfer')
+
+
+# Helper: stream individual <IVRScripts> blocks out of the upload as (name, XMLDefinition) pairs
+def iter_ivrscripts(stream: BinaryIO) -> Iterator[Tuple[str, str]]:
+    # Exports are a bare sequence of <IVRScripts>, so feed them inside a synthetic root
+    parser = ET.XMLPullParser(events=('end',), tag='IVRScripts', huge_tree=True,
+                              collect_ids=False, remove_blank_text=True)
+    parser.feed(b'<root>')
+    chunk = stream.read(_READ_CHUNK).lstrip(b'\xef\xbb\xbf').lstrip()  # strip BOM
+    if chunk.startswith(b'<?xml'):
+        decl_end = chunk.find(b'?>')
+        if decl_end != -1:
+            chunk = chunk[decl_end + 2:]
+    while chunk:
+        parser.feed(chunk.translate(None, b'\x00'))  # libxml2 rejects raw NUL bytes
+        yield from _drain_ivrscripts(parser)
+        chunk = stream.read(_READ_CHUNK)
+    parser.feed(b'</root>')
+    yield from _drain_ivrscripts(parser)
+    parser.close()
+
+def _drain_ivrscripts(parser: ET.XMLPullParser) -> Iterator[Tuple[str, str]]:
+    for _, elem in parser.read_events():
+        name = elem.findtext('Name', default='').strip()
+        xml_def = elem.findtext('XMLDefinition', default='')
+        # Drop the finished block and its earlier siblings so only one script is held in memory
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+        yield name, xml_def
+
+# Helper: reusable parser for inner IVR documents, which have no meaningful IDs or indentation
+def _inner_parser() -> ET.XMLParser:
+    parser = getattr(_PARSER_LOCAL, 'parser', None)
+    if parser is None:
+        parser = _PARSER_LOCAL.parser = ET.XMLParser(collect_ids=False, remove_blank_text=True, huge_tree=True)
+    return parser
+
+# Helper: drop control characters XML 1.0 forbids (incl. NUL); str.translate is several times
+# faster than the regex on ASCII text but much slower once the string holds wider characters
+def _strip_ctrl(xml: str) -> str:
+    return xml.translate(_DEL_TBL) if xml.isascii() else _CTRL_RE.sub('', xml)
+
+# Helper: clean embedded IVR XMLDefinition for valid parsing
+def clean_xml_definition(raw_def: str) -> str:
+    if '&' not in raw_def:
+        return _strip_ctrl(raw_def)
+    if '&#' in raw_def:
+        xml = html.unescape(raw_def)
+    else:
+        # Five9 exports only use the five XML entities; &amp; must go last
+        xml = (raw_def.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+               .replace('&apos;', "'").replace('&amp;', '&'))
+    return _strip_ctrl(_AMP_RE.sub('&amp;', xml))
+
+# Helper: stripped element text, '' for a missing element or empty text
+def _txt(e: Optional[ET._Element], _strip=str.strip) -> str:
+    t = e.text if e is not None else None
+    return _strip(t) if t else ''
+
+# Extract Call Variables, Variables, Skills and Prompts in one walk per module
+def extract_all(ivr_root: ET._Element, script_name: str) -> Tuple[set, set, set, set]:
+    # Sets drop repeated rows (same variable/prompt reused in a module) as they are collected
+    call_vars, vars_, skills, prompts = set(), set(), set(), set()
+    modules_elem = ivr_root.find('modules')
+    if modules_elem is None:
+        return call_vars, vars_, skills, prompts
+    # Local aliases keep attribute/global lookups out of the per-element loop
+    add_call_var, add_var, add_skill, add_prompt = call_vars.add, vars_.add, skills.add, prompts.add
+    intern, skill_transfer, txt = sys.intern, _SKILL_TRANSFER, _txt
+    for mod in modules_elem.iterchildren(ET.Element):  # skip comments/PIs
+        # Interned so rows share one 'Source Module'/'Module Name' string across modules and scripts
+        tag = intern(mod.tag)
+        name = intern(mod.findtext('moduleName', default='').strip())
+        walk_tags = _SKILL_MODULE_TAGS if tag is skill_transfer else _MODULE_TAGS
+        for el in mod.iter(*walk_tags):
+            el_tag = el.tag
+            if el_tag == 'prompt':
+                text = txt(el.find('name'))
+                if text:
+                    add_prompt((script_name, text, name))
+            elif el_tag == 'listOfSkillsEx':
+                for skl in el.iterfind('extrnalObj/name'):
+                    text = txt(skl)
+                    if text:
+                        add_skill((script_name, text, name))
+            else:
+                text = txt(el)
+                if not text:
+                    continue
+                if '.' in text:
+                    group = intern(text.partition('.')[0])
+                    add_call_var((script_name, text, name, tag, 'Call Variable', group))
+                else:
+                    add_var((script_name, text, name, tag, 'Variable', ''))
+    return call_vars, vars_, skills, prompts
+
+# Build Graph Data
+def build_flow_graph(ivr_root: ET._Element) -> Tuple[Dict[str, List[Tuple[str, Optional[str]]]], Dict[str, str]]:
+    edges, labels = {}, {}
+    modules_elem = ivr_root.find('modules')
+    if modules_elem is None:
+        return edges, labels
+    branch_entries, branch_desc, txt = _BRANCH_ENTRY_XPATH, _BRANCH_DESC_XPATH, _txt
+    # One pass collects labels and candidate edges; lxml keeps comments/PIs, so skip them
+    for mod in modules_elem.iterchildren(ET.Element):
+        findtext = mod.findtext
+        src = findtext('moduleId', default='').strip()
+        if not src:
+            continue
+        labels[src] = findtext('moduleName', default='').strip() or mod.tag
+        add_succ = edges.setdefault(src, []).append
+        for sd in mod.iterfind('singleDescendant'):
+            add_succ((txt(sd), None))
+        for entry in branch_entries(mod):
+            k = entry.find('key')
+            if k is not None:
+                add_succ((branch_desc(entry).strip(), txt(k)))
+    # Targets can only be validated once every moduleId has been seen; repeated
+    # (target, key) pairs from the same module collapse to one edge, first one wins
+    for succs in edges.values():
+        succs[:] = [(dst, key) for dst, key in succs if dst in labels]
+        if len(succs) > 1:
+            succs[:] = dict.fromkeys(succs)
+    return edges, labels
+
+# Helper: DOT source as one joined string, without per-node/edge Digraph builder calls
+def _dot_source(edges: Dict[str, List[Tuple[str, Optional[str]]]], labels: Dict[str, str]) -> str:
+    esc = _DOT_ESCAPE
+    parts = [_DOT_HEADER]
+    parts.extend(f'\t"{nid.translate(esc)}" [label="{lbl.translate(esc)}"]\n' for nid, lbl in labels.items())
+    for src, succs in edges.items():
+        s = src.translate(esc)
+        for dst, key in succs:
+            if key:
+                parts.append(f'\t"{s}" -> "{dst.translate(esc)}" [xlabel="{key.translate(esc)}"]\n')
+            else:
+                parts.append(f'\t"{s}" -> "{dst.translate(esc)}"\n')
+    parts.append('}\n')
+    return ''.join(parts)
+
+# Process a single script block (run inline or by pool workers)
+def process_script(name: str, xml_def: str, idx: int) -> Tuple[str, Dict, bool]:
+    name = name or f'Script {idx}'
+    
+    if not xml_def:
+        return name, {'error': 'Missing XMLDefinition'}, False
+    
+    cleaned = clean_xml_definition(xml_def)
+    try:
+        ivr = ET.fromstring(cleaned.encode('utf-8'), _inner_parser())
+    except ET.ParseError as e:
+        return name, {'error': f'Inner XML parse: {e}'}, False
+    
+    cvs, vs, ss, ps = extract_all(ivr, name)
+    # Diagram text is derived now, so diagrams never re-parse the XML and the view's cache key
+    # is one string rather than a nested edge structure hashed item by item on every rerun
+    edges, labels = build_flow_graph(ivr)
+    
+    data = {
+        'Call Variables': cvs,
+        'Variables': vs,
+        'Skills': ss,
+        'Prompts': ps,
+        'Dot': _dot_source(edges, labels)
+    }
+    
+    return name, data, True